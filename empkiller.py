@@ -1,13 +1,10 @@
-from bs4 import BeautifulSoup
 import json
-import requests
-import re
+import lxml.html
 import pandas as pd
-from io import StringIO
 from datetime import datetime, timedelta, timezone
 from twill.commands import *
+from twill.browser import browser
 import os
-from os import path
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -16,6 +13,37 @@ from googleapiclient.errors import HttpError
 import pytz
 from tzlocal import get_localzone
 
+# The roster table id is prefixed with an ASP.NET control path that can
+# change between deployments, so match on the trailing control name.
+_ROSTER_TABLE_XPATH = "//table[contains(@id, 'gridPersonalRoster')]"
+
+# Format of a shift timestamp once the year is spliced in,
+# e.g. "Fri, Feb 21 2025, 17:00".
+_SHIFT_DT_FMT = '%a, %b %d %Y, %H:%M'
+
+# Ids of the spans holding the currently displayed period's date range.
+_PERIOD_START_ID = "_content_ctl09__filtersPersonal__lblStartDate"
+_PERIOD_END_ID = "_content_ctl09__filtersPersonal__lblEndDate"
+
+# Format of the period label dates, e.g. "17 Feb 2025".
+_PERIOD_DT_FMT = '%d %b %Y'
+
+# Error sentinels EmpLive puts in the page <title>, and the message to
+# raise when each one appears.
+_TITLE_ERRORS = (
+    ("Error", "400 Bad Request\nUnknown error accessing EmpLive roster, check token.json is correct."),
+    ("Access Denied", "401 Unauthorised\nForbidden from accessing EmpLive roster, check token.json is correct."),
+    ("Session Timed Out", "408 Request Timeout\nASP.NET Session has timed out, create a new session token by logging in."),
+)
+
+def _week_start(date):
+    """
+    Returns the first day of the week containing ``date`` as a datetime
+    at midnight. EmpLive identifies each roster period by this date.
+    """
+    date = date - timedelta(days=date.weekday())
+    return date.replace(hour=0, minute=0, second=0, microsecond=0)
+
 class Scraper:
     """
         EmpLive ESS home page web scraper.
@@ -24,7 +52,7 @@ class Scraper:
         to access EmpLive ESS remotely using
         your login credentials, then extracts
         raw HTML from the website and reads
-        it with BeautifulSoup.
+        it with lxml.
     """
 
     def __init__(self, username, password):
@@ -55,57 +83,85 @@ class Scraper:
         follow("Personal Roster")
         code('200')
 
+        # Whether the period filter exposes a date field goto_period can
+        # jump with; cleared the first time a jump fails so later calls
+        # go straight to stepping week by week.
+        self._date_jump_supported = True
+
     def next_period(self):
         """
         Navigate to the next week's shift roster.
         """
+        # The postback response already contains the new page, so no
+        # reload() round-trip is needed afterwards.
         submit("_content_ctl09__filtersPersonal__btnForward")
-        reload()
-    
+
     def prev_period(self):
         """
         Navigate to the previous week's shift roster.
         """
         submit("_content_ctl09__filtersPersonal__btnBack")
-        reload()
 
-    def get_roster_page(self, tmp_file = "tmp/Home.aspx"):
+    def goto_period(self, date):
+        """
+        Try to jump straight to the roster period containing ``date``
+        by filling in the period filter's date field, instead of
+        clicking through one week at a time.
+
+        Args:
+            date (datetime): Any day inside the desired roster period.
+
+        Returns:
+            success (bool): Whether the jump could be submitted.
+                False means the form has no usable date field and the
+                caller should step through periods one at a time.
+        """
+        if not self._date_jump_supported:
+            return False
+
+        try:
+            fv('1', '_content_ctl09__filtersPersonal__txtStartDate', date.strftime('%d/%m/%Y'))
+            submit('_content_ctl09__filtersPersonal__btnRefresh')
+        except Exception:
+            self._date_jump_supported = False
+            return False
+
+        return True
+
+    def get_roster_page(self):
         """
             Gets the entire EmpLive ESS employee home page as raw HTML code.
             Uses the user token stored in token.json.
 
-            Args:
-                tmp_file (str) : Where to temporarily store the HTML webpage file.
-            
             Returns:
-                page (BeautifulSoup) : The scraped home page.
+                page (lxml.html.HtmlElement) : The scraped home page.
         """
 
-        # Create folder for output file if not exists
-        tmp_dir, _ = os.path.split(tmp_file)
-        os.makedirs(tmp_dir, exist_ok=True)
+        # Read the page straight out of the twill browser rather than
+        # round-tripping it through a temp file on disk.
+        raw_data = browser.html
 
-        save_html(tmp_file) # Print the web HTML data to console output.
-        
-        with open(tmp_file, "r") as f:
-            raw_data = f.read()
-            f.close()
+        # ESS serves UTF-8; decode explicitly if the browser hands back
+        # bytes so no charset sniffing ever runs.
+        if isinstance(raw_data, bytes):
+            raw_data = raw_data.decode('utf-8')
 
-        os.remove(tmp_file)
-        os.removedirs(tmp_dir)
+        # Check the error sentinels against the raw <title> text before
+        # building the tree, so error pages are never parsed at all.
+        title_start = raw_data.find('<title')
+        title_end = raw_data.find('</title>', title_start)
 
-        soup = BeautifulSoup(raw_data, 'html5lib')
+        if title_start != -1 and title_end != -1:
+            title = raw_data[title_start:title_end]
 
-        if "Error" in soup.title.string:
-            raise Exception("400 Bad Request\nUnknown error accessing EmpLive roster, check token.json is correct.")
-        
-        if "Access Denied" in soup.title.string:
-            raise Exception("401 Unauthorised\nForbidden from accessing EmpLive roster, check token.json is correct.")
+            for needle, error in _TITLE_ERRORS:
+                if needle in title:
+                    raise Exception(error)
 
-        if "Session Timed Out" in soup.title.string:
-            raise Exception("408 Request Timeout\nASP.NET Session has timed out, create a new session token by logging in.")
-
-        return soup
+        # Parse with lxml directly rather than wrapping the tree in
+        # BeautifulSoup: all the lookups the Extractor performs stay in
+        # C this way, with no Tag objects allocated.
+        return lxml.html.fromstring(raw_data)
 
 class Extractor:
     """
@@ -113,8 +169,12 @@ class Extractor:
         out of EmpLive HTML dumps.
     """
     def __init__(self):
-        pass
-    
+        # get_period memo: identity of the last page parsed and its
+        # period. EmpKiller only holds one page at a time, so a single
+        # slot is enough.
+        self._period_page_id = None
+        self._period = None
+
     def parse_roster_dates(self, roster):
         """
         Given an EmpLive employee roster as DataFrame,
@@ -130,18 +190,15 @@ class Extractor:
         """
         current_year = datetime.today().year
 
-        for i, shift in enumerate(roster.to_dict(orient='records')):
-            start_time_str = f"{shift["Date"]} {current_year}, {shift["Start Time"]}"
-            end_time_str = f"{shift["Date"]} {current_year}, {shift["End Time"]}"
-            
-            start_time = pd.to_datetime(start_time_str, format='%a, %b %d %Y, %H:%M')
-            end_time = pd.to_datetime(end_time_str, format='%a, %b %d %Y, %H:%M')
+        # Build the full timestamp strings column-wise, then parse each
+        # column with one vectorized to_datetime call instead of two
+        # parse calls and a .loc write per row.
+        dates = roster["Date"] + f" {current_year}, "
 
-            roster.loc[i, "Start Time"] = start_time
-            roster.loc[i, "End Time"] = end_time
+        roster["Start Time"] = pd.to_datetime(dates + roster["Start Time"], format=_SHIFT_DT_FMT, cache=True)
+        roster["End Time"] = pd.to_datetime(dates + roster["End Time"], format=_SHIFT_DT_FMT, cache=True)
 
-        del roster["Date"]
-        del roster["Roster"]
+        roster.drop(columns=["Date", "Roster"], inplace=True)
 
         return roster
 
@@ -150,63 +207,55 @@ class Extractor:
             Converts a HTML employee roster table into a DataFrame.
 
             Args:
-                roster_html_table (bs4.element.Tag): A raw HTML employee roster table scraped from the EmpLive ESS home page.
-            
+                roster_html_table (lxml.html.HtmlElement): A raw HTML employee roster table scraped from the EmpLive ESS home page.
+
             Returns:
                 roster (DataFrame): The same roster parsed as a DataFrame.
         """
-        roster_table_rows = roster_html_table.find_all('tr')
-        roster_table_head = roster_table_rows[0]
-        roster_table_data = roster_table_rows[1:]
-
-        headings = {h.string : None for h in roster_table_head.find_all('th')}
-
-        shifts = []
-        for row in roster_table_data:
+        rows = roster_html_table.iter('tr')
 
-            shift = headings.copy()
+        # The first row holds the column headings.
+        headings = [th.text_content().strip() for th in next(rows).iter('th')]
 
-            row_data = row.find_all('td')
+        # Accumulate the table column-wise so the DataFrame is built
+        # directly from whole columns rather than one dict per row.
+        columns = {heading : [] for heading in headings}
 
-            row_text = [i.find('span') for i in row_data]
-            row_strings = [i.string if i is not None else None for i in row_text]
+        for row in rows:
+            # Each cell's value lives in a <span>; empty cells have none.
+            spans = (td.find('.//span') for td in row.iter('td'))
+            for heading, span in zip(headings, spans):
+                columns[heading].append(span.text if span is not None else None)
 
-            for i, key in enumerate(shift.keys()):
-                shift[key] = row_strings[i]
-            
-            shifts.append(shift)
-
-        shifts = pd.DataFrame(shifts)
+        shifts = pd.DataFrame(columns)
 
         # Convert dates from string format to datetime format.
         shifts = self.parse_roster_dates(shifts)
 
         return shifts
     
-    def get_roster(self, home_page : BeautifulSoup):
+    def get_roster(self, home_page : lxml.html.HtmlElement):
         """
             Get the roster table from the EmpLive ESS scrape and convert it to a DataFrame.
 
             Args:
-                home_page (BeautifulSoup): A web scrape of the EmpLive ESS home page.
-            
+                home_page (lxml.html.HtmlElement): A web scrape of the EmpLive ESS home page.
+
             Returns:
                 roster (DataFrame | None): The employee's roster.
         """
 
-        roster_table = home_page.find('table', id=re.compile('[a-zA-Z0-9_-]*gridPersonalRoster'))
+        roster_tables = home_page.xpath(_ROSTER_TABLE_XPATH)
 
-        if roster_table is None:
+        if not roster_tables:
             return None
             #raise Exception("Unable to find employee roster table in web scrape.")
 
-        roster_table = home_page.find('table', id=re.compile('[a-zA-Z0-9_-]*gridPersonalRoster'))
-
-        roster = self.parse_roster_html_table(roster_table)
+        roster = self.parse_roster_html_table(roster_tables[0])
 
         return roster
     
-    def get_period(self, home_page : BeautifulSoup):
+    def get_period(self, home_page : lxml.html.HtmlElement):
 
         """
             The EmpLive ESS website can only display rosters one week ("period")
@@ -214,18 +263,26 @@ class Extractor:
             period from the EmpLive website as a datetime.
 
             Args:
-                home_page (BeautifulSoup): A web scrape of the EmpLive ESS home page.
-            
+                home_page (lxml.html.HtmlElement): A web scrape of the EmpLive ESS home page.
+
             Returns:
                 start_date (datetime)
         """
+        # Repeated calls on the same page return the memoized period.
+        if id(home_page) == self._period_page_id:
+            return self._period
+
         # Extract the period date strings
-        period_start = home_page.find("span", id ="_content_ctl09__filtersPersonal__lblStartDate").string
-        period_end = home_page.find("span", id ="_content_ctl09__filtersPersonal__lblEndDate").string
+        period_start = home_page.get_element_by_id(_PERIOD_START_ID).text
+        period_end = home_page.get_element_by_id(_PERIOD_END_ID).text
+
+        # Convert to datetime. These are two scalar strings, so plain
+        # strptime skips all of pd.to_datetime's array handling.
+        period_start = datetime.strptime(period_start, _PERIOD_DT_FMT)
+        period_end = datetime.strptime(period_end, _PERIOD_DT_FMT)
 
-        # Convert to datetime
-        period_start = pd.to_datetime(period_start, format='%d %b %Y')
-        period_end = pd.to_datetime(period_end, format='%d %b %Y')
+        self._period_page_id = id(home_page)
+        self._period = period_start
 
         return period_start#, period_end
 
@@ -246,10 +303,13 @@ class EmpKiller:
         """
         with open(login_data) as f:
             data = json.load(f)
-            f.close()
-        
+
         self.sc = Scraper(data.get("username"), data.get("password"))
         self.ex = Extractor()
+
+        # Rosters already fetched this session, keyed by week start.
+        self._roster_cache = {}
+
         self.reload_page()
 
     def reload_page(self):
@@ -265,7 +325,11 @@ class EmpKiller:
                 None
         """
         self.page = self.sc.get_roster_page()
-    
+
+        # The page only changes when it is reloaded, so parse the
+        # period date once here instead of on every get_period call.
+        self._period = self.ex.get_period(self.page)
+
     def get_period(self):
         """
             The EmpLive ESS website can only display rosters one week ("period")
@@ -278,7 +342,7 @@ class EmpKiller:
             Returns:
                 period (datetime): The starting day of the current roster.
         """
-        return self.ex.get_period(self.page)
+        return self._period
 
     def go_to_week(self, starting_date, max_reloads = 10):
         """
@@ -303,11 +367,20 @@ class EmpKiller:
                 None
         """
         # Make starting_date the first day of the week.
-        starting_date = starting_date - timedelta(days=starting_date.weekday())
-        starting_date = starting_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        starting_date = _week_start(starting_date)
 
         website_date = self.get_period()
-        
+
+        # Already on the desired period: nothing to do.
+        if website_date == starting_date:
+            return
+
+        # Try to jump straight to the desired period with one postback;
+        # fall back to clicking a week at a time if the site ignores it.
+        if self.sc.goto_period(starting_date):
+            self.reload_page()
+            website_date = self.get_period()
+
         # print(f"Website period: {website_date.strftime("%d/%m/%Y %I:%M:%S")}")
         # print(f"Desired period: {starting_date.strftime("%d/%m/%Y %I:%M:%S")}")
         # print(f"Difference: {(website_date - starting_date).days} days")
@@ -330,14 +403,15 @@ class EmpKiller:
             # print(f"Desired period: {starting_date.strftime("%d/%m/%Y %I:%M:%S")}")
             # print(f"Difference: {(website_date - starting_date).days} days")
 
-    def get_roster_by_date(self, starting_date : datetime = datetime.today(), max_reloads = 10):
+    def get_roster_by_date(self, starting_date : datetime = None, max_reloads = 10):
         """
             Get *one week*'s roster from the EmpLive website using a starting date.
 
             Args:
-                starting_date (datetime): 
+                starting_date (datetime):
                     The starting date for which week's roster you want to obtain.
                     This date will automatically be converted to first day of the week if it is not already.
+                    Defaults to today.
                 max_reloads (int):
                     The maximum number of times this function may press the "Next / Previous Period"
                     buttons on the EmpLive website to find the target roster period.
@@ -346,11 +420,64 @@ class EmpKiller:
             Returns:
                 roster (DataFrame | None):
                     The weekly roster as a DataFrame, or *None* if no roster exists for the given week.
+                    Each week's roster is cached for the lifetime of this
+                    EmpKiller session, so asking for the same week twice
+                    does not hit the website again.
         """
-        self.go_to_week(starting_date, max_reloads=max_reloads)
-        self.reload_page()
-        return self.ex.get_roster(self.page)
-    
+        # Resolve the default here: a datetime.today() default argument
+        # is evaluated once at import time and goes stale.
+        if starting_date is None:
+            starting_date = datetime.today()
+
+        week = _week_start(starting_date)
+
+        if week in self._roster_cache:
+            return self._roster_cache[week]
+
+        # go_to_week always leaves self.page freshly loaded on the
+        # target week, so no extra reload is needed here.
+        self.go_to_week(week, max_reloads=max_reloads)
+
+        roster = self.ex.get_roster(self.page)
+        self._roster_cache[week] = roster
+
+        return roster
+
+    def get_rosters(self, starting_dates, max_reloads = 10):
+        """
+            Get the rosters for *several weeks* in one pass.
+
+            Fetching many weeks with separate ``get_roster_by_date`` calls
+            navigates from wherever the website happens to be each time.
+            This method visits the requested weeks in date order instead,
+            so each week is at most a few navigation steps away from the
+            previous one.
+
+            EmpLive navigation is a stateful ASP.NET postback chain, so
+            the weeks cannot be fetched concurrently; minimising the
+            number of page loads is the next best thing.
+
+            Args:
+                starting_dates (list[datetime]):
+                    One date inside each week you want the roster for.
+                max_reloads (int):
+                    The maximum number of times this function may press the "Next / Previous Period"
+                    buttons on the EmpLive website to find each roster period.
+                    If we don't reach a target period in time, this *will raise an Exception*!
+
+            Returns:
+                rosters (list[DataFrame | None]):
+                    One weekly roster per requested date, in the same order
+                    as ``starting_dates``.
+        """
+        weeks = [_week_start(date) for date in starting_dates]
+
+        rosters = {}
+        for week in sorted(set(weeks)):
+            rosters[week] = self.get_roster_by_date(week, max_reloads=max_reloads)
+
+        return [rosters[week] for week in weeks]
+
     def get_roster(self, weeks_ahead = 0, max_reloads=10):
         """
             Get *the current week*'s roster from the EmpLive website.
@@ -413,24 +540,27 @@ class GoogleCalendar:
 
         except HttpError as error:
             raise Exception(f"Error accessing Google Calendar API:\n{error}")
-    
-    def to_timestamp(self, time : datetime, timezone : str = get_localzone().key):
+
+        # Resolve the user's local timezone once; get_localzone probes
+        # the filesystem and pytz.timezone does a database lookup, so
+        # neither belongs in the per-event path.
+        self._local_tz = pytz.timezone(get_localzone().key)
+
+    def to_timestamp(self, time : datetime, timezone : str = None):
         """
         Convert naive datetime timestamp into a RFC3339 timestamp in UTC timezone.
 
         Args:
             time (datetime) : The naive datetime timestamp.
             timezone (str): The timezone to use. Defaults to the user's local timezone.
-        
+
         Returns:
             timestamp (str) : The RFC3339 timestamp in UTC timezone.
         """
 
-        # Get the user's local timezone using tzlocal
-        # local_tz = get_localzone().key
-
-        # Convert timezone string into pytz format
-        local_tz = pytz.timezone(timezone)
+        # Use the timezone resolved at construction time unless the
+        # caller asks for a different one.
+        local_tz = self._local_tz if timezone is None else pytz.timezone(timezone)
 
         # Localize the naive timestamp (assume it's in the local timezone)
         localized_timestamp = local_tz.localize(time)
@@ -489,15 +619,37 @@ class GoogleCalendar:
             # events = list(filter(lambda x : x.get('summary') == name, events))
 
             # Delete overlapping events
-            if len(events) > 0 and overwrite:
-                for event in events:
-                    cal.events().delete(
-                        calendarId=calendarId,
-                        eventId=event['id']
-                    ).execute()
-        
-        # Create new event data structure
-        event = {
+            for event in events:
+                cal.events().delete(
+                    calendarId=calendarId,
+                    eventId=event['id']
+                ).execute()
+
+        # Insert event into user's calendar
+        created_event = cal.events().insert(
+            calendarId=calendarId,
+            body=self._event_body(start_time, end_time, name, location, description, reminder_time)
+        ).execute()
+
+        # Return ID of the event
+        return created_event['id']
+
+    def _event_body(self, start_time, end_time, name, location, description, reminder_time):
+        """
+            Build the request body for a Google Calendar event.
+
+            Args:
+                start_time (str): Event start as an RFC3339 timestamp in UTC.
+                end_time (str): Event end as an RFC3339 timestamp in UTC.
+                name (str): Name of the event.
+                location (str): Event location.
+                description (str): Event description.
+                reminder_time (int): How many minutes before the event to send a reminder notification.
+
+            Returns:
+                event (dict): The event request body.
+        """
+        return {
             'summary':name,
             'location':location,
             'description':description,
@@ -518,15 +670,29 @@ class GoogleCalendar:
                 ]
             }
         }
-        
-        # Insert event into user's calendar
-        created_event = cal.events().insert(
-            calendarId=calendarId,
-            body=event
-        ).execute()
 
-        # Return ID of the event
-        return created_event['id']
+    def _overlaps(self, event, window_start, window_end):
+        """
+            Whether a Google Calendar event overlaps a time window.
+
+            Args:
+                event (dict): An event resource returned by the Calendar API.
+                window_start (datetime): Window start, timezone-aware.
+                window_end (datetime): Window end, timezone-aware.
+
+            Returns:
+                overlaps (bool): Whether the event intersects the window.
+        """
+        event_start = datetime.fromisoformat(event['start'].get('dateTime', event['start'].get('date')))
+        event_end = datetime.fromisoformat(event['end'].get('dateTime', event['end'].get('date')))
+
+        # All-day events come back as bare dates with no timezone.
+        if event_start.tzinfo is None:
+            event_start = pytz.utc.localize(event_start)
+        if event_end.tzinfo is None:
+            event_end = pytz.utc.localize(event_end)
+
+        return event_start < window_end and event_end > window_start
 
     def add_roster(self, roster_data, reminder_time : int = 30, name : str = "Work", location : str = None, calendarId : str = 'primary', overwrite : bool = True):
         """
@@ -544,15 +710,57 @@ class GoogleCalendar:
                 None
         """
 
-        for shift in roster_data.to_dict(orient="records"):
-            
-            self.create_event(
-                start_time = shift["Start Time"],
-                end_time = shift["End Time"],
-                name = name,
-                location = location,
-                description = shift["Role"],
-                calendarId = calendarId,
-                overwrite = overwrite,
-                reminder_time=reminder_time
-            )
\ No newline at end of file
+        cal = self.service
+
+        shifts = roster_data.to_dict(orient="records")
+        if not shifts:
+            return
+
+        # One query spanning the whole roster finds every event that
+        # could overlap any shift; each shift is then matched against
+        # the result in memory instead of issuing a list call per shift.
+        existing = []
+        if overwrite:
+            existing = cal.events().list(
+                calendarId=calendarId,
+                timeMin=self.to_timestamp(min(shift["Start Time"] for shift in shifts)),
+                timeMax=self.to_timestamp(max(shift["End Time"] for shift in shifts)),
+                singleEvents=True,
+                timeZone="UTC",
+            ).execute().get("items", [])
+
+        # Group the API calls for the whole roster into batch requests:
+        # one round-trip for the deletes and one for the inserts instead
+        # of several sequential HTTPS round-trips per shift.
+        delete_batch = cal.new_batch_http_request()
+        insert_batch = cal.new_batch_http_request()
+
+        # Ids of overlapping events already queued for deletion, so an
+        # event spanning two shifts isn't deleted twice.
+        doomed = set()
+
+        for shift in shifts:
+
+            start_time = self.to_timestamp(shift["Start Time"])
+            end_time = self.to_timestamp(shift["End Time"])
+
+            # Queue deletions for any events overlapping this shift.
+            if overwrite:
+                window_start = datetime.fromisoformat(start_time)
+                window_end = datetime.fromisoformat(end_time)
+
+                for event in existing:
+                    if event['id'] not in doomed and self._overlaps(event, window_start, window_end):
+                        doomed.add(event['id'])
+                        delete_batch.add(cal.events().delete(
+                            calendarId=calendarId,
+                            eventId=event['id']
+                        ))
+
+            insert_batch.add(cal.events().insert(
+                calendarId=calendarId,
+                body=self._event_body(start_time, end_time, name, location, shift["Role"], reminder_time)
+            ))
+
+        delete_batch.execute()
+        insert_batch.execute()
\ No newline at end of file